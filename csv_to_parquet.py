@@ -0,0 +1,30 @@
+import os
+import duckdb
+
+CSV_FILES = ["cust.csv", "cntt.csv", "claim.csv"]
+
+def parquet_file_for(csv_file):
+    return csv_file.replace(".csv", ".parquet")
+
+def stale_parquet_files():
+    """Parquet files that are missing or older than the CSV they are converted from."""
+    stale = []
+    for csv_file in CSV_FILES:
+        parquet_file = parquet_file_for(csv_file)
+        if not os.path.exists(parquet_file) or os.path.getmtime(parquet_file) < os.path.getmtime(csv_file):
+            stale.append(parquet_file)
+    return stale
+
+# Deploy-time conversion, run again whenever the source CSVs change:
+#     python csv_to_parquet.py
+if __name__ == "__main__":
+    for csv_file in CSV_FILES:
+        parquet_file = parquet_file_for(csv_file)
+        # Write beside the target and swap it in, so a running app never reads a partial file
+        tmp_file = parquet_file + ".tmp"
+        duckdb.sql(f"""
+            COPY (SELECT * FROM read_csv_auto('{csv_file}'))
+            TO '{tmp_file}' (FORMAT PARQUET, COMPRESSION ZSTD)
+        """)
+        os.replace(tmp_file, parquet_file)
+        print(f"{csv_file} -> {parquet_file}")
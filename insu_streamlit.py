@@ -1,41 +1,208 @@
+import os
+import shutil
+import tempfile
 import streamlit as st
-import pandas as pd
+import altair as alt
 import duckdb
-import matplotlib.pyplot as plt
-import seaborn as sns
+from csv_to_parquet import stale_parquet_files
 
-CUSTOMERS_FILE = "cust.csv"
-CNTT_FILE = "cntt.csv"
-CLAIM_FILE = "claim.csv"
+# Parquet copies of cust.csv / cntt.csv / claim.csv. They are generated at deploy time,
+# not committed: run `python csv_to_parquet.py` again whenever a CSV changes.
+CUSTOMERS_FILE = "cust.parquet"
+CNTT_FILE = "cntt.parquet"
+CLAIM_FILE = "claim.parquet"
 
 st.set_page_config(page_title="Insurance Database Viewer", layout="wide")
 
-@st.cache_data
-def load_csv_data(file_path):
-    return pd.read_csv(file_path)
+# Tables are built from the Parquet files once; later runs just open the file. It is
+# rebuilt when a Parquet file is newer than it. Bump SCHEMA_VERSION whenever
+# build_tables() changes so old files are not reused.
+SCHEMA_VERSION = 5
+DB_FILE = f"insurance_v{SCHEMA_VERSION}.duckdb"
+TABLE_FILES = {"customers": CUSTOMERS_FILE, "cntt": CNTT_FILE, "claim": CLAIM_FILE}
+# Source tables plus the derived ones build_tables() creates from them
+REQUIRED_TABLES = set(TABLE_FILES) | {"cntt_cust"}
+
+def build_tables(c):
+    for table_name, file_path in TABLE_FILES.items():
+        c.execute(f"CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM read_parquet('{file_path}')")
+
+    # Low-cardinality group-by keys: SEX is a 1/2 code, products become an ENUM.
+    # A rebuild replaces every table above, so the old type can be dropped too.
+    c.execute("ALTER TABLE customers ALTER SEX SET DATA TYPE UTINYINT")
+    c.execute("DROP TYPE IF EXISTS product_t")
+    c.execute("""
+        CREATE TYPE product_t AS ENUM (
+            SELECT DISTINCT GOOD_CLSF_CDNM FROM cntt WHERE GOOD_CLSF_CDNM IS NOT NULL ORDER BY 1
+        )
+    """)
+    c.execute("ALTER TABLE cntt ALTER GOOD_CLSF_CDNM SET DATA TYPE product_t")
+
+    c.execute("ALTER TABLE customers ADD COLUMN AGE_GROUP VARCHAR")
+    c.execute("""
+        UPDATE customers
+        SET AGE_GROUP = CASE
+                            WHEN AGE < 25 THEN 'Under 25'
+                            WHEN AGE BETWEEN 25 AND 40 THEN '25-40'
+                            WHEN AGE BETWEEN 41 AND 60 THEN '41-60'
+                            ELSE 'Above 60'
+                        END
+    """)
+
+    c.execute("ALTER TABLE customers ADD COLUMN IS_FRAUD BOOLEAN")
+    c.execute("UPDATE customers SET IS_FRAUD = SIU_CUST_YN = 'Y'")
+
+    # Pre-joined, two-column policy/fraud table for the product queries
+    c.execute("""
+        CREATE OR REPLACE TABLE cntt_cust AS
+        SELECT cntt.GOOD_CLSF_CDNM, customers.IS_FRAUD
+        FROM cntt
+        JOIN customers USING (CUST_ID)
+    """)
 
-customers_df = load_csv_data(CUSTOMERS_FILE)
-cntt_df = load_csv_data(CNTT_FILE)
-claim_df = load_csv_data(CLAIM_FILE)
+def db_is_current():
+    if not os.path.exists(DB_FILE):
+        return False
+    if os.path.getmtime(DB_FILE) < max(os.path.getmtime(f) for f in TABLE_FILES.values()):
+        return False
+    with duckdb.connect(database=DB_FILE, read_only=True) as c:
+        existing_tables = {row[0] for row in c.execute("SELECT table_name FROM information_schema.tables").fetchall()}
+    return existing_tables >= REQUIRED_TABLES
+
+def rebuild_db():
+    # Build into a private file and swap it into place, so DB_FILE itself is only ever
+    # opened read-only and other sessions or processes reading it are not blocked.
+    build_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(DB_FILE)))
+    try:
+        build_file = os.path.join(build_dir, DB_FILE)
+        with duckdb.connect(database=build_file) as c:
+            build_tables(c)
+        os.replace(build_file, DB_FILE)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+@st.cache_resource
+def get_conn():
+    if not db_is_current():
+        rebuild_db()
+
+    # Read-only, so SQL typed into the Custom Query tab cannot change the database
+    c = duckdb.connect(database=DB_FILE, read_only=True)
+    # Use the CPUs this process may actually run on (os.cpu_count() ignores affinity),
+    # but never more than DuckDB's own default, which also accounts for container limits
+    if hasattr(os, "sched_getaffinity"):
+        available_cpus = len(os.sched_getaffinity(0))
+    else:
+        available_cpus = os.cpu_count() or 1
+    default_threads = c.execute("SELECT current_setting('threads')").fetchone()[0]
+    threads = min(available_cpus, default_threads)
+    c.execute(f"PRAGMA threads={threads}")
+    if c.execute("SELECT current_setting('threads')").fetchone()[0] != threads:
+        raise RuntimeError(f"DuckDB did not accept PRAGMA threads={threads}")
+    return c
+
+stale_files = stale_parquet_files()
+if stale_files:
+    st.error(f"{', '.join(stale_files)} missing or older than the CSV data. Run `python csv_to_parquet.py` first.")
+    st.stop()
+
+# The cached connection is shared by every session; each rerun gets its own cursor
+# because a DuckDB connection must not be used from several threads at once.
+conn = get_conn().cursor()
+
+Q_STATS = """
+    SELECT (SELECT COUNT(DISTINCT CUST_ID) FROM customers) AS TOTAL_CUSTOMERS,
+           (SELECT COUNT(DISTINCT POLY_NO) FROM cntt) AS TOTAL_POLICIES,
+           (SELECT COUNT(POLY_NO) FROM claim) AS TOTAL_CLAIMS
+"""
+
+Q_GENDER_OVERVIEW = """
+    SELECT SEX,
+           COUNT(*) FILTER (WHERE IS_FRAUD) AS FRAUD_COUNT,
+           COUNT(*) AS TOTAL_COUNT,
+           ROUND(COUNT(*) FILTER (WHERE IS_FRAUD) * 100.0 / COUNT(*), 2) AS FRAUD_RATE
+    FROM customers
+    GROUP BY SEX
+"""
+
+Q_AGE_OVERVIEW = """
+    SELECT AGE_GROUP,
+           COUNT(*) FILTER (WHERE IS_FRAUD) AS FRAUD_COUNT,
+           COUNT(*) AS TOTAL_COUNT,
+           ROUND(COUNT(*) FILTER (WHERE IS_FRAUD) * 100.0 / COUNT(*), 2) AS FRAUD_RATE
+    FROM customers
+    GROUP BY AGE_GROUP
+"""
+
+Q_GENDER = """
+    SELECT SEX,
+           COUNT(*) AS TOTAL_CUSTOMERS,
+           COUNT(*) FILTER (WHERE IS_FRAUD) AS FRAUD_COUNT,
+           COUNT(*) FILTER (WHERE IS_FRAUD) * 100.0 / COUNT(*) AS FRAUD_RATE
+    FROM customers
+    GROUP BY SEX
+    ORDER BY SEX
+"""
+
+Q_AGE = """
+    SELECT AGE_GROUP,
+           COUNT(*) AS TOTAL_CUSTOMERS,
+           COUNT(*) FILTER (WHERE IS_FRAUD) AS FRAUD_COUNT,
+           COUNT(*) FILTER (WHERE IS_FRAUD) * 100.0 / COUNT(*) AS FRAUD_RATE
+    FROM customers
+    GROUP BY AGE_GROUP
+    ORDER BY MIN(AGE)
+"""
+
+Q_PRODUCT = """
+    SELECT GOOD_CLSF_CDNM,
+           COUNT(*) AS TOTAL_POLICIES,
+           COUNT(*) FILTER (WHERE IS_FRAUD) AS FRAUD_COUNT,
+           COUNT(*) FILTER (WHERE IS_FRAUD) * 100.0 / COUNT(*) AS FRAUD_RATE
+    FROM cntt_cust
+    GROUP BY GOOD_CLSF_CDNM
+    ORDER BY FRAUD_RATE DESC
+    LIMIT 5
+"""
+
+# Every fixed query returns at most a handful of rows over static data, so the
+# results are computed once and shared by all sessions until the TTL expires.
+@st.cache_resource(ttl=3600)
+def precomputed():
+    return {
+        "stats": conn.execute(Q_STATS).fetchone(),
+        "gender_overview": conn.execute(Q_GENDER_OVERVIEW).df(),
+        "age_overview": conn.execute(Q_AGE_OVERVIEW).df(),
+        "gender": conn.execute(Q_GENDER).df(),
+        "age": conn.execute(Q_AGE).df(),
+        "product": conn.execute(Q_PRODUCT).df(),
+    }
+
+SORT_COLUMNS = {"customers": "CUST_ID", "cntt": "POLY_NO", "claim": "POLY_NO"}
+# Columns build_tables() derives for the queries; the raw view shows only source data
+DERIVED_COLUMNS = {"customers": ["AGE_GROUP", "IS_FRAUD"]}
+
+def fraud_rate_chart(df, x, title):
+    # sort=None keeps the result's row order on the x axis instead of sorting it
+    return alt.Chart(df, title=title).mark_bar().encode(
+        x=alt.X(f"{x}:N", sort=None),
+        y=alt.Y("FRAUD_RATE:Q", title="Fraud Rate (%)"),
+    )
 
-conn = duckdb.connect(database=':memory:')
-conn.register("customers", customers_df)
-conn.register("cntt", cntt_df)
-conn.register("claim", claim_df)
+@st.cache_data
+def load_preview(table_name, sort_col):
+    derived = DERIVED_COLUMNS.get(table_name)
+    columns = f"* EXCLUDE ({', '.join(derived)})" if derived else "*"
+    return conn.execute(f"SELECT {columns} FROM {table_name} ORDER BY {sort_col}").df()
 
 st.sidebar.title("Insurance Fraud Analysis")
 menu = st.sidebar.radio("Navigate", ["Insurance Database","Overview", "Queries and Visualizations", "Summaries and Action Plans"])
 
 if menu == "Insurance Database":
     st.title("Insurance Database 💼")
-    selected_table = st.selectbox("Select a table to view:", ["customers", "cntt", "claim"])
+    selected_table = st.selectbox("Select a table to view:", list(SORT_COLUMNS))
 
-    if selected_table == "customers":
-        st.dataframe(customers_df.sort_values(by="CUST_ID", ascending=True))
-    elif selected_table == "cntt":
-        st.dataframe(cntt_df.sort_values(by="POLY_NO", ascending=True))
-    elif selected_table == "claim":
-        st.dataframe(claim_df.sort_values(by="POLY_NO", ascending=True))
+    st.dataframe(load_preview(selected_table, SORT_COLUMNS[selected_table]))
 
 elif menu == "Overview":
     st.title("Overview of Insurance Database")
@@ -47,32 +214,10 @@ elif menu == "Overview":
     - **총 고객, 정책 및 청구에 대한 통찰력을 얻기기**
     """)
 
-    total_customers = customers_df['CUST_ID'].nunique()
-    total_policies = cntt_df['POLY_NO'].nunique()
-    total_claims = claim_df['POLY_NO'].count()
-
-    gender_fraud_rate = conn.execute("""
-        SELECT SEX, 
-               SUM(CASE WHEN SIU_CUST_YN = 'Y' THEN 1 ELSE 0 END) AS FRAUD_COUNT,
-               COUNT(*) AS TOTAL_COUNT,
-               ROUND((SUM(CASE WHEN SIU_CUST_YN = 'Y' THEN 1 ELSE 0 END) * 100.0) / COUNT(*), 2) AS FRAUD_RATE
-        FROM customers
-        GROUP BY SEX
-    """).df()
-
-    age_fraud_rate = conn.execute("""
-        SELECT CASE 
-                   WHEN AGE < 25 THEN 'Under 25'
-                   WHEN AGE BETWEEN 25 AND 40 THEN '25-40'
-                   WHEN AGE BETWEEN 41 AND 60 THEN '41-60'
-                   ELSE 'Above 60'
-               END AS AGE_GROUP,
-               SUM(CASE WHEN SIU_CUST_YN = 'Y' THEN 1 ELSE 0 END) AS FRAUD_COUNT,
-               COUNT(*) AS TOTAL_COUNT,
-               ROUND((SUM(CASE WHEN SIU_CUST_YN = 'Y' THEN 1 ELSE 0 END) * 100.0) / COUNT(*), 2) AS FRAUD_RATE
-        FROM customers
-        GROUP BY AGE_GROUP
-    """).df()
+    summaries = precomputed()
+    total_customers, total_policies, total_claims = summaries["stats"]
+    gender_fraud_rate = summaries["gender_overview"]
+    age_fraud_rate = summaries["age_overview"]
 
     col1, col2, col3 = st.columns(3)
     col1.metric("Total Customers", total_customers)
@@ -97,93 +242,53 @@ elif menu == "Queries and Visualizations":
         )
 
         if query == "Fraud by Gender":
-            result = conn.execute("""
-                SELECT SEX, 
-                       COUNT(*) AS TOTAL_CUSTOMERS,
-                       SUM(CASE WHEN SIU_CUST_YN = 'Y' THEN 1 ELSE 0 END) AS FRAUD_COUNT,
-                       AVG(CASE WHEN SIU_CUST_YN = 'Y' THEN 1.0 ELSE 0.0 END) * 100 AS FRAUD_RATE
-                FROM customers
-                GROUP BY SEX
-            """).df()
+            result = precomputed()["gender"]
             st.dataframe(result)
 
             st.subheader("Query Graph:")
-            fig, ax = plt.subplots()
-            sns.barplot(data=result, x="SEX", y="FRAUD_RATE", palette="coolwarm", ax=ax)
-            ax.set_title("Fraud Rate by Gender")
-            ax.set_ylabel("Fraud Rate (%)")
-            st.pyplot(fig)
+            st.altair_chart(fraud_rate_chart(result, "SEX", "Fraud Rate by Gender"))
 
         elif query == "Fraud by Age Group":
-            result = conn.execute("""
-                SELECT CASE 
-                           WHEN AGE < 25 THEN 'Under 25'
-                           WHEN AGE BETWEEN 25 AND 40 THEN '25-40'
-                           WHEN AGE BETWEEN 41 AND 60 THEN '41-60'
-                           ELSE 'Above 60' 
-                       END AS AGE_GROUP,
-                       COUNT(*) AS TOTAL_CUSTOMERS,
-                       SUM(CASE WHEN SIU_CUST_YN = 'Y' THEN 1 ELSE 0 END) AS FRAUD_COUNT,
-                       AVG(CASE WHEN SIU_CUST_YN = 'Y' THEN 1.0 ELSE 0.0 END) * 100 AS FRAUD_RATE
-                FROM customers
-                GROUP BY AGE_GROUP
-            """).df()
+            result = precomputed()["age"]
             st.dataframe(result)
 
             st.subheader("Query Graph:")
-            fig, ax = plt.subplots()
-            sns.barplot(data=result, x="AGE_GROUP", y="FRAUD_RATE", palette="muted", ax=ax)
-            ax.set_title("Fraud Rate by Age Group")
-            ax.set_ylabel("Fraud Rate (%)")
-            st.pyplot(fig)
+            st.altair_chart(fraud_rate_chart(result, "AGE_GROUP", "Fraud Rate by Age Group"))
 
         elif query == "Fraud by insurance products":
-            result = conn.execute("""SELECT 
-                        GOOD_CLSF_CDNM,
-                        COUNT(*) AS TOTAL_POLICIES,
-                        SUM(CASE WHEN customers.SIU_CUST_YN = 'Y' THEN 1 ELSE 0 END) AS FRAUD_COUNT,
-                        AVG(CASE WHEN customers.SIU_CUST_YN = 'Y' THEN 1.0 ELSE 0.0 END) * 100 AS FRAUD_RATE
-                    FROM cntt
-                    JOIN customers ON cntt.CUST_ID = customers.CUST_ID
-                    GROUP BY GOOD_CLSF_CDNM
-                    ORDER BY FRAUD_RATE desc
-                    Limit 5;""").df()
-    
+            result = precomputed()["product"]
             st.dataframe(result)
 
             st.subheader("Query Graph:")
-            fig, ax = plt.subplots()
-            sns.barplot(data=result, x="GOOD_CLSF_CDNM", y="FRAUD_RATE", palette="muted", ax=ax)
-            ax.set_title("Fraud Rate by Insurance Products")
-            ax.set_ylabel("Fraud Rate (%)")
-            custom_labels = ["1", "2", "3", "4", "5"]
-            ax.set_xticklabels(custom_labels)  
-            st.pyplot(fig)
+            st.altair_chart(fraud_rate_chart(result, "GOOD_CLSF_CDNM", "Fraud Rate by Insurance Products"))
 
 
 
     
     with tab2:
         st.header("Run Custom SQL Query")
-        st.text("Example Queries:")
-        st.markdown("""
-        - **가장 많은 청구를 한 상위 10대 고객**:
-        ```sql
-        SELECT CUST_ID, COUNT(*) AS TOTAL_CLAIMS
-        FROM claim
-        GROUP BY CUST_ID
-        ORDER BY TOTAL_CLAIMS DESC
-        LIMIT 10
-        ```
-        """)
-
-        query = st.text_area("Enter your SQL Query", height=150)
-        if st.button("Execute Query"):
-            try:
-                result = conn.execute(query).df()
-                st.dataframe(result)
-            except Exception as e:
-                st.error(f"Error: {e}")
+        # The editor widgets are only built once the user opens them; st.tabs
+        # would otherwise construct them on every rerun of this page.
+        if st.toggle("Open SQL editor", key="show_custom"):
+            st.text("Example Queries:")
+            st.markdown("""
+            - **가장 많은 청구를 한 상위 10대 고객**:
+            ```sql
+            SELECT CUST_ID, COUNT(*) AS TOTAL_CLAIMS
+            FROM claim
+            GROUP BY CUST_ID
+            ORDER BY TOTAL_CLAIMS DESC
+            LIMIT 10
+            ```
+            """)
+
+            query = st.text_area("Enter your SQL Query", height=150)
+            if st.button("Execute Query"):
+                try:
+                    result = conn.execute(query).df()
+                    st.dataframe(result)
+                except Exception as e:
+                    st.error(f"Error: {e}")
 
 elif menu == "Summaries and Action Plans":
     st.title("Summaries & Action Plans 📋")